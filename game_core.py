@@ -1,10 +1,13 @@
 from scipy import stats
+import numpy as np
 import math
 import re
 from basketball_reference_scraper.players import get_game_logs
 import bbrefscraper
 import time
 import ast
+import copy
+import zlib
 
 TEAMS = ["ATL", "BOS", "BRK", "CHI", "CHO", "CLE", "DAL", "DEN", "DET", "GSW", "HOU", "IND", "LAC", "LAL", "MEM", "MIA", "MIL", "MIN", "NOP", "NYK", "OKC", "ORL", "PHI", "PHO", "POR", "SAC", "SAS", "TOR", "UTA", "WAS"]
 EAST_CONF = ["ATL", "BOS", "BRK", "CHI", "CHO", "CLE", "DET", "IND", "MIA", "MIL", "NYK", "ORL", "PHI", "TOR", "WAS"]
@@ -127,6 +130,17 @@ def load_players(readFromDefaultFile=True):
 
     return dict
 
+"""
+Returns the factor used to normalize a player's stats by the minutes they are
+expected to play compared to the minutes their distributions were built from.
+@param info Values to use for stat distributions and random sampling
+"""
+def minutes_scale(info):
+    scale = info["curr_mins"]/info["prev_mins"] if info["prev_mins"] > 0 else 0
+    if scale > 1.5:
+        scale = math.log(scale)
+    return scale
+
 """
 Simulate a game outcome for the player with profile "info" (as stored in the dictionary
 with all of the league data). Samples and creates convolutions that are normalized by
@@ -145,9 +159,7 @@ def simulate_box_score(info, overtime=False):
     if fta < 0: fta = 0
     ftm = round(fta * stats.beta(info["ft"]["ftp"]["make"], info["ft"]["ftp"]["miss"]).rvs())
 
-    scale = info["curr_mins"]/info["prev_mins"] if info["prev_mins"] > 0 else 0
-    if scale > 1.5:
-        scale = math.log(scale)
+    scale = minutes_scale(info)
 
     pts = round(scale * (ftm + 2 * two_fgm + 3 * three_fgm))
     if pts < 0: pts = 0
@@ -318,29 +330,44 @@ def simulate_season(dict):
     simulate_playoffs(dict, east_conf_stadings, west_conf_stadings)
 
 """
-Uses bootstrapping with 1000 samples to generate the probability a given
-team wins. Also generates the averages for each player across those 1000 games,
-as well as the option to query these samples to explore conditional probabilities
-(ex. "What is the probability the Lakers win given LeBron James scores more than 30 points?")
-@param dict A dictionary storing information about the entire league
+Returns every matchup on a given date of the schedule, in the format "AWAY v. HOME"
+@param date The day of the matchups in the format YYYY-MM-DD
 """
-def give_game_odds(dict):
-    date = input("Enter a date (YYYY-MM-DD): ")
-    while re.search("\d\d\d\d-\d\d-\d\d", date) == None:
-        date = input(f"Invalid date {date}\nEnter a date (YYYY-MM-DD): ")
-    date = re.search("\d\d\d\d-\d\d-\d\d", date).group(0)
+def get_matchups(date):
     options = []
     with open("assets/2022schedule", "r") as f:
         for line in f:
             line = line.strip().split(': ')
             if line[0] == date:
                 options.append(line[1])
+    return options
+
+"""
+Prompts the user for a date and one of the games scheduled on it. Returns the date,
+the matchups on that date, and the index of the chosen matchup.
+"""
+def choose_game():
+    date = input("Enter a date (YYYY-MM-DD): ")
+    while re.search("\d\d\d\d-\d\d-\d\d", date) == None:
+        date = input(f"Invalid date {date}\nEnter a date (YYYY-MM-DD): ")
+    date = re.search("\d\d\d\d-\d\d-\d\d", date).group(0)
+    options = get_matchups(date)
     for i in range(len(options)):
         print(f"{i}. {options[i]}")
     choice = input("Select a game: ")
     while choice not in [str(x) for x in range(len(options))]:
         choice = input(f"Invalid choice {choice}\nSelect a game: ")
-    choice = int(choice)
+    return date, options, int(choice)
+
+"""
+Uses bootstrapping with 1000 samples to generate the probability a given
+team wins. Also generates the averages for each player across those 1000 games,
+as well as the option to query these samples to explore conditional probabilities
+(ex. "What is the probability the Lakers win given LeBron James scores more than 30 points?")
+@param dict A dictionary storing information about the entire league
+"""
+def give_game_odds(dict):
+    date, options, choice = choose_game()
 
     away, home = options[choice][:3], options[choice][-3:]
     away_w, home_w = 0, 0
@@ -390,6 +417,202 @@ def give_game_odds(dict):
             print(f"{team} wins {win_and_pv/pv}% of the time when {player} scores {point_val} or more points")
             end = input('Quit? (y/n): ')
 
+"""
+Returns the part of a player's profile that their cached stat streams depend on.
+Minutes only rescale a sampled stream, so they are left out and can be changed
+without sampling the player again.
+@param info Values to use for stat distributions and random sampling
+"""
+def shooting_profile(info):
+    return str([info["2fg"], info["3fg"], info["ft"]])
+
+"""
+Samples one more appearance for every game in a cached player stream. Only the
+values that decide a game's outcome (unscaled points and field goal attempts) are
+kept, and each stream has its own generator, so the k-th appearance is the same
+no matter which scenario first needed it.
+@param stream A player stream created by sample_player_stream
+"""
+def extend_player_stream(stream):
+    info, rng, n = stream["info"], stream["rng"], stream["samples"]
+    two_fga = np.maximum(np.round(stats.norm(info["2fg"]["2fga"]["mean"], info["2fg"]["2fga"]["std"]).rvs(size=n, random_state=rng)), 0)
+    two_fgm = np.round(two_fga * stats.beta(info["2fg"]["2fgp"]["make"], info["2fg"]["2fgp"]["miss"]).rvs(size=n, random_state=rng))
+    three_fga = np.maximum(np.round(stats.norm(info["3fg"]["3fga"]["mean"], info["3fg"]["3fga"]["std"]).rvs(size=n, random_state=rng)), 0)
+    three_fgm = np.round(three_fga * stats.beta(info["3fg"]["3fgp"]["make"], info["3fg"]["3fgp"]["miss"]).rvs(size=n, random_state=rng))
+    fta = np.maximum(np.round(stats.norm(info["ft"]["fta"]["mean"], info["ft"]["fta"]["std"]).rvs(size=n, random_state=rng)), 0)
+    ftm = np.round(fta * stats.beta(info["ft"]["ftp"]["make"], info["ft"]["ftp"]["miss"]).rvs(size=n, random_state=rng))
+
+    stream["pts"] = np.column_stack((stream["pts"], ftm + 2 * two_fgm + 3 * three_fgm))
+    stream["fga"] = np.column_stack((stream["fga"], two_fga + three_fga))
+
+"""
+Creates the cached stat stream for a player across every sampled game of a scenario.
+The generator is seeded from the scenario seed and the player, so the stream does
+not depend on which other players are in the rotation.
+@param info Values to use for stat distributions and random sampling
+@param team The team the player is on (ex. LAL)
+@param player The name of the player
+@param samples Number of games sampled for the scenario
+@param seed Seed shared by every stream in the scenario
+"""
+def sample_player_stream(info, team, player, samples, seed):
+    stream = {
+        "info": copy.deepcopy(info),
+        "rng": np.random.default_rng([seed, zlib.crc32(team.encode()), zlib.crc32(player.encode())]),
+        "samples": samples,
+        "pts": np.empty((samples, 0)),
+        "fga": np.empty((samples, 0))
+    }
+    extend_player_stream(stream)
+    return stream
+
+"""
+Returns the points and field goal attempts of a player's next appearance in every
+sampled game, following the same rules as simulate_box_score.
+@param stream A player stream created by sample_player_stream
+@param used How many appearances the player has already made in each game
+@param info The player's profile, including any changed minutes
+@param overtime Mask of games in which the appearance only covers a five minute period
+"""
+def next_appearance(stream, used, info, overtime):
+    while used.max() >= stream["pts"].shape[1]:
+        extend_player_stream(stream)
+    games = np.arange(stream["samples"])
+    pts = np.maximum(np.round(minutes_scale(info) * stream["pts"][games, used]), 0)
+    fga = stream["fga"][games, used]
+    return np.where(overtime, np.trunc(pts * (5/48)), pts), np.where(overtime, np.trunc(fga * (5/48)), fga)
+
+"""
+Creates a what-if scenario for a single game. Player stat streams are sampled
+under a fixed seed and cached the first time they are needed, so later changes
+to the rotation only resample the players whose shooting profile changed.
+@param dict A dictionary storing information about the entire league
+@param away The name of the away team (ex. ATL)
+@param home The name of the home team (ex. DET)
+@param samples Number of games to sample
+@param seed Seed used for every player stream in the scenario
+"""
+def build_scenario(dict, away, home, samples=1000, seed=109):
+    scenario = {"away": away, "home": home, "samples": samples, "seed": seed, "streams": {}}
+    evaluate_scenario(dict, scenario)
+    return scenario
+
+"""
+Returns the odds for a scenario after applying the given changes on top of the
+rotations stored in dict, which is left unmodified. Each sampled game is replayed
+the same way simulate_game plays it, using cached player streams.
+@param dict A dictionary storing information about the entire league
+@param scenario A scenario created by build_scenario
+@param changes Changes per team, in the format {TEAM_NAME: {PLAYER_NAME: CHANGE}}, where
+CHANGE is None to sit the player, or a dictionary of values (ex. {"curr_mins": 40}) that
+overrides the player's profile. Players not yet on the team need a complete profile.
+"""
+def evaluate_scenario(dict, scenario, changes=None):
+    away, home, n = scenario["away"], scenario["home"], scenario["samples"]
+    changes = changes if changes is not None else {}
+    rotations = {}
+    for team in [away, home]:
+        rotations[team] = {player: info for player, info in dict["teams"][team].items()}
+        for player, change in changes.get(team, {}).items():
+            if change is None:
+                rotations[team].pop(player, None)
+            else:
+                rotations[team][player] = {**rotations[team].get(player, {}), **change}
+        if len(rotations[team]) == 0:
+            raise ValueError(f"{team} has no players in its rotation")
+
+    streams = {}
+    used = {}
+    for team in [away, home]:
+        for player, info in rotations[team].items():
+            key = (team, player, shooting_profile(info))
+            if key not in scenario["streams"]:
+                scenario["streams"][key] = sample_player_stream(info, team, player, n, scenario["seed"])
+            streams[(team, player)] = scenario["streams"][key]
+            used[(team, player)] = np.zeros(n, dtype=int)
+
+    pts = {home: np.zeros(n), away: np.zeros(n)}
+    for team in [home, away]:
+        fga = np.zeros(n)
+        active = np.ones(n, dtype=bool)
+        while active.any():
+            for player, info in rotations[team].items():
+                box_pts, box_fga = next_appearance(streams[(team, player)], used[(team, player)], info, used[(team, player)] > 0)
+                pts[team] += np.where(active, box_pts, 0)
+                fga += np.where(active, box_fga, 0)
+                used[(team, player)] += active
+                active &= fga < PACE
+
+    tied = pts[home] == pts[away]
+    while tied.any():
+        for team in [home, away]:
+            fga = np.zeros(n)
+            active = tied.copy()
+            for player, info in rotations[team].items():
+                box_pts, box_fga = next_appearance(streams[(team, player)], used[(team, player)], info, True)
+                pts[team] += np.where(active, box_pts, 0)
+                fga += np.where(active, box_fga, 0)
+                used[(team, player)] += active
+                active &= fga < PACE * (5/48)
+        tied = pts[home] == pts[away]
+
+    away_w = int(np.count_nonzero(pts[away] > pts[home]))
+    return {
+        away: {"win%": 100 * away_w / n, "pts": float(pts[away].mean())},
+        home: {"win%": 100 * (n - away_w) / n, "pts": float(pts[home].mean())}
+    }
+
+"""
+Creates a what-if scenario for every game scheduled on a given date.
+@param dict A dictionary storing information about the entire league
+@param date The day of the slate in the format YYYY-MM-DD
+@param samples Number of games to sample for each matchup
+@param seed Seed used for every player stream on the slate
+"""
+def build_slate(dict, date, samples=1000, seed=109):
+    slate = {}
+    for matchup in get_matchups(date):
+        slate[matchup] = build_scenario(dict, matchup[:3], matchup[-3:], samples=samples, seed=seed)
+    return slate
+
+"""
+Returns the odds for every game on a slate under each what-if, in the same order
+as what_ifs. Games whose teams are untouched by a what-if are re-aggregated from
+the cached streams without sampling anything.
+@param dict A dictionary storing information about the entire league
+@param slate A slate created by build_slate
+@param what_ifs A list of changes in the format accepted by evaluate_scenario
+"""
+def evaluate_what_ifs(dict, slate, what_ifs):
+    results = []
+    for changes in what_ifs:
+        results.append({matchup: evaluate_scenario(dict, scenario, changes) for matchup, scenario in slate.items()})
+    return results
+
+"""
+Allows a user to explore how the odds for a game change when players sit or
+play different minutes, without rerunning the full simulation each time.
+@param dict A dictionary storing information about the entire league
+"""
+def explore_what_ifs(dict):
+    date, options, choice = choose_game()
+    away, home = options[choice][:3], options[choice][-3:]
+    print("Sampling players...")
+    scenario = build_scenario(dict, away, home)
+    changes = {away: {}, home: {}}
+    end = ''
+    while end != 'y':
+        odds = evaluate_scenario(dict, scenario, changes)
+        print(f"{away}: {odds[away]['win%']}%, {home}: {odds[home]['win%']}%\n")
+        team = away if input(f"Choose 0 for {away}, 1 for {home}: ") == '0' else home
+        roster = list(dict['teams'][team].keys())
+        for i in range(len(roster)):
+            print(f"{i}. {roster[i]}")
+        player = roster[int(input('Choose a player: '))]
+        mins = float(input(f"How many minutes does {player} play? (0 to sit): "))
+        changes[team][player] = None if mins == 0 else {"curr_mins": mins}
+        end = input('Quit? (y/n): ')
+
 """
 Allows a user to explore specific game outcomes after a season is stored in dict
 @param dict A dictionary storing information about the entire league
@@ -426,8 +649,8 @@ def main():
         dict = scrape_today(dict)
     defaultPlayers = input("Would you like to give a custom player file? (y/n): ") == 'n'
     dict = load_players(readFromDefaultFile=defaultPlayers)
-    print("Welcome to my CS109 Project, PIECH for NBA! Select a simulation mode:\n1. Full Season\n2. Single Game\n")
-    resp = input("Type 1 or 2 (q to quit): ")
+    print("Welcome to my CS109 Project, PIECH for NBA! Select a simulation mode:\n1. Full Season\n2. Single Game\n3. What-If Scenarios\n")
+    resp = input("Type 1, 2, or 3 (q to quit): ")
     while resp != 'q':
         if resp == '1':
             simulate_season(dict)
@@ -436,7 +659,9 @@ def main():
             give_game_odds(dict)
             # Reset dict
             dict = load_players(readFromDefaultFile=defaultPlayers)
-        resp = input("Type 1 or 2 (q to quit): ")
+        elif resp == '3':
+            explore_what_ifs(dict)
+        resp = input("Type 1, 2, or 3 (q to quit): ")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file